@@ -1,22 +1,70 @@
 #!/usr/bin/env python3
 import os
+import re
+import hmac
 import json
+import hashlib
 import logging
+import resource
 import time
 import requests
 import random
 import schedule
-from datetime import datetime, timedelta
-from threading import Thread
-from flask import Flask, jsonify
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from logging.handlers import RotatingFileHandler
+from threading import Thread, Lock, RLock
+from flask import Flask, jsonify, request
+from requests.adapters import HTTPAdapter
+from snapshot_store import SNAPSHOT_SUFFIX, Snapshot, write_snapshot
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('FusionBot')
 
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
+TELEGRAM_BOT_TOKENS = os.environ.get('TELEGRAM_BOT_TOKENS', '')
+TELEGRAM_UPDATE_MODE = os.environ.get('TELEGRAM_UPDATE_MODE', 'polling')
+TELEGRAM_WEBHOOK_SECRET = os.environ.get('TELEGRAM_WEBHOOK_SECRET')
 OPENWEATHER_API_KEY = os.environ.get('OPENWEATHER_API_KEY')
 RENDER_SERVICE_URL = os.environ.get('RENDER_SERVICE_URL', 'https://your-service.onrender.com')
-TELEGRAM_API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+TELEGRAM_API_BASE = "https://api.telegram.org/bot"
+OPENWEATHER_API = "https://api.openweathermap.org/data/2.5"
+DATA_FILE = os.environ.get('DATA_FILE', 'fusion_bot_data.json')
+BACKLOG_MAX_AGE = int(os.environ.get('BACKLOG_MAX_AGE', 900))
+TELEGRAM_BATCH_LIMIT = 100
+TELEGRAM_OFFSET_MAX_AGE = 7 * 24 * 3600  # Telegram reinicia update_id tras una semana sin updates
+FLOOD_WINDOW = int(os.environ.get('FLOOD_WINDOW', 60))
+FLOOD_USER_LIMIT = int(os.environ.get('FLOOD_USER_LIMIT', 20))
+FLOOD_CHAT_LIMIT = int(os.environ.get('FLOOD_CHAT_LIMIT', 40))
+FLOOD_MAX_LABELS = 50
+COMMAND_COSTS = {'/clima': 4, '/loto': 2, '/programar': 2, '/dashboard': 2, '/stats': 2}
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 4))
+WEATHER_REFRESH_BASE = int(os.environ.get('WEATHER_REFRESH_BASE', 1800))
+WEATHER_REFRESH_MIN = int(os.environ.get('WEATHER_REFRESH_MIN', 300))
+WEATHER_MAX_AGE = int(os.environ.get('WEATHER_MAX_AGE', 3600))
+WEATHER_BATCH_SIZE = int(os.environ.get('WEATHER_BATCH_SIZE', 10))
+WEATHER_BATCH_PAUSE = float(os.environ.get('WEATHER_BATCH_PAUSE', 1.0))
+WEATHER_THREADS = int(os.environ.get('WEATHER_THREADS', 2))
+TRAFFIC_CAPTURE_PATH = os.environ.get('TRAFFIC_CAPTURE_PATH')
+TRAFFIC_CAPTURE_MAX_BYTES = int(os.environ.get('TRAFFIC_CAPTURE_MAX_BYTES', 10 * 1024 * 1024))
+TRAFFIC_CAPTURE_BACKUPS = int(os.environ.get('TRAFFIC_CAPTURE_BACKUPS', 5))
+TRAFFIC_CAPTURE_SALT = os.environ.get('TRAFFIC_CAPTURE_SALT')
+CAPTURE_KEEP_ARGS = {'/clima', '/charada', '/clima_diario', '/cancelar'}
+THROTTLE_REPLY = "⏳ *Vas muy rápido.* Espera unos segundos antes de enviar más comandos."
+PROCESS_START = time.time()
+
+# Pool compartido: las conexiones TLS a Telegram/OpenWeather se reutilizan entre peticiones
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20))
+http_session.mount('http://', HTTPAdapter(pool_connections=10, pool_maxsize=20))
+worker_pool = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix='Worker')
+# Pool propio del refresco de clima: un lote lento no debe quitar workers a los updates
+weather_pool = ThreadPoolExecutor(max_workers=WEATHER_THREADS, thread_name_prefix='Weather')
 
 class KeepAliveManager:
     def __init__(self):
@@ -25,7 +73,7 @@ class KeepAliveManager:
         
     def self_ping(self):
         try:
-            response = requests.get(RENDER_SERVICE_URL, timeout=10)
+            response = http_session.get(RENDER_SERVICE_URL, timeout=10)
             self.ping_count += 1
             self.last_ping = datetime.now()
             if response.status_code == 200:
@@ -45,17 +93,334 @@ class KeepAliveManager:
                 logger.error(f"Error en keepalive: {e}")
                 time.sleep(300)
 
-class DataManager:
+class WarmupManager:
     def __init__(self):
-        self.data = {
+        self.started_at = PROCESS_START
+        self.phases = {}
+        self.steps = []
+        self.failed = {}
+        self.ready = False
+        self.warmed_at = None
+        self.first_reply_seconds = None
+        self.lock = Lock()
+
+    def record_phase(self, name, started):
+        self.phases[name] = round(time.time() - started, 3)
+
+    def add_step(self, name, func, required=False):
+        self.steps.append((name, func, required))
+
+    def warm_up(self):
+        with self.lock:
+            if self.ready:
+                return False
+
+            self.failed = {}
+            for name, func, required in self.steps:
+                started = time.time()
+                try:
+                    func()
+                except Exception as e:
+                    self.failed[name] = str(e)
+                    logger.error(f"Error en warm-up ({name}): {e}")
+                self.record_phase(name, started)
+
+            if any(required and name in self.failed for name, _, required in self.steps):
+                logger.warning(f"⚠️ Warm-up incompleto, se reintentará en el próximo /wake: {self.failed}")
+                return False
+
+            self.ready = True
+            self.warmed_at = datetime.now()
+            self.record_phase('total_hasta_listo', self.started_at)
+            estado = f" (degradado: {', '.join(self.failed)})" if self.failed else ""
+            logger.info(f"🔥 Warm-up completado en {self.phases['total_hasta_listo']}s{estado}: {self.phases}")
+            return True
+
+    def mark_reply(self):
+        if self.first_reply_seconds is None:
+            self.first_reply_seconds = round(time.time() - self.started_at, 3)
+            logger.info(f"⚡ Primera respuesta enviada {self.first_reply_seconds}s después del arranque")
+
+    def report(self):
+        return {
+            'ready': self.ready,
+            'degraded': bool(self.failed),
+            'failed_steps': dict(self.failed),
+            'phases': dict(self.phases),
+            'time_to_first_reply': self.first_reply_seconds,
+            'warmed_at': self.warmed_at.isoformat() if self.warmed_at else None
+        }
+
+class FloodControl:
+    def __init__(self, window=FLOOD_WINDOW, user_limit=FLOOD_USER_LIMIT, chat_limit=FLOOD_CHAT_LIMIT):
+        self.window = window
+        self.limits = {'user': user_limit, 'chat': chat_limit}
+        # (ámbito, id) -> [ventana, coste actual, coste ventana anterior, ventana avisada]
+        self.counters = {}
+        self.admitted = 0
+        self.throttled = Counter()
+        self.dropped = Counter()
+        self.lock = Lock()
+
+    def command_label(self, text):
+        if not text.startswith('/'):
+            return '(texto)'
+        label = text.split()[0].split('@')[0]
+        if label not in COMMAND_COSTS and label not in self.throttled and label not in self.dropped \
+                and len(set(self.throttled) | set(self.dropped)) >= FLOOD_MAX_LABELS:
+            return '(otros)'
+        return label
+
+    def check(self, user_id, chat_id, text):
+        command = self.command_label(text)
+        cost = COMMAND_COSTS.get(command, 1)
+        now = time.time()
+        bucket = int(now // self.window)
+        previous_weight = 1 - (now % self.window) / self.window
+
+        with self.lock:
+            keys = (('user', user_id), ('chat', chat_id))
+            counters = []
+            for key in keys:
+                counter = self.counters.setdefault(key, [bucket, 0, 0, -1])
+                if counter[0] != bucket:
+                    counter[2] = counter[1] if counter[0] == bucket - 1 else 0
+                    counter[1] = 0
+                    counter[0] = bucket
+                counters.append(counter)
+
+            for (scope, _), counter in zip(keys, counters):
+                if counter[2] * previous_weight + counter[1] + cost > self.limits[scope]:
+                    if counter[3] != bucket:
+                        counter[3] = bucket
+                        self.throttled[command] += 1
+                        return 'throttle'
+                    self.dropped[command] += 1
+                    return 'drop'
+
+            for counter in counters:
+                counter[1] += cost
+            self.admitted += 1
+            return 'ok'
+
+    def evict(self):
+        bucket = int(time.time() // self.window)
+        with self.lock:
+            stale = [key for key, counter in self.counters.items() if counter[0] < bucket - 1]
+            for key in stale:
+                del self.counters[key]
+        return len(stale)
+
+    def report(self):
+        return {
+            'admitted': self.admitted,
+            'throttled': dict(self.throttled),
+            'dropped': dict(self.dropped),
+            'tracked_counters': len(self.counters),
+            'window_seconds': self.window,
+            'limits': dict(self.limits)
+        }
+
+class WeatherService:
+    def __init__(self):
+        # ciudad normalizada -> (timestamp, datos)
+        self.cache = {}
+        self.checked = {}
+        self.hits = 0
+        self.misses = 0
+        self.refreshed = 0
+        self.errors = 0
+
+    @staticmethod
+    def city_key(ciudad):
+        return ' '.join(ciudad.lower().split())
+
+    @staticmethod
+    def refresh_interval(usuarios):
+        return max(WEATHER_REFRESH_MIN, WEATHER_REFRESH_BASE / max(usuarios, 1))
+
+    def fetch(self, ciudad):
+        key = self.city_key(ciudad)
+        self.checked[key] = time.time()
+        params = {
+            'q': key,
+            'appid': OPENWEATHER_API_KEY,
+            'units': 'metric',
+            'lang': 'es'
+        }
+        response = http_session.get(f"{OPENWEATHER_API}/weather", params=params, timeout=10)
+        if response.status_code != 200:
+            return None
+
+        data = response.json()
+        datos = {
+            'temp': data['main']['temp'],
+            'descripcion': data['weather'][0]['description'],
+            'humedad': data['main']['humidity'],
+            'viento': data['wind']['speed']
+        }
+        entry = (time.time(), datos)
+        self.cache[key] = entry
+        return entry
+
+    def get(self, ciudad):
+        entry = self.cache.get(self.city_key(ciudad))
+        if entry and time.time() - entry[0] <= WEATHER_MAX_AGE:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return self.fetch(ciudad)
+
+    def _refresh(self, key):
+        try:
+            if self.fetch(key):
+                self.refreshed += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error refrescando clima de {key}: {e}")
+
+    def refresh_due(self, user_locations, limit=None):
+        usuarios = Counter(self.city_key(ciudad) for ciudad in user_locations.values())
+        now = time.time()
+        due = [key for key, total in usuarios.most_common()
+               if now - self.checked.get(key, 0) >= self.refresh_interval(total)]
+        if limit:
+            due = due[:limit]
+
+        for i in range(0, len(due), WEATHER_BATCH_SIZE):
+            if i:
+                time.sleep(WEATHER_BATCH_PAUSE)
+            list(weather_pool.map(self._refresh, due[i:i + WEATHER_BATCH_SIZE]))
+
+        self.evict(set(usuarios))
+        return len(due)
+
+    def evict(self, saved_keys):
+        now = time.time()
+        for key, checked_at in list(self.checked.items()):
+            if key not in saved_keys and now - checked_at > WEATHER_MAX_AGE:
+                self.checked.pop(key, None)
+                self.cache.pop(key, None)
+
+    def run_refresh_loop(self):
+        while True:
+            try:
+                if OPENWEATHER_API_KEY:
+                    refrescadas = self.refresh_due(all_user_locations())
+                    if refrescadas:
+                        logger.info(f"🌤️ Clima refrescado para {refrescadas} ciudades")
+                time.sleep(60)
+            except Exception as e:
+                logger.error(f"Error en refresco de clima: {e}")
+                time.sleep(60)
+
+    def report(self):
+        return {
+            'cached_cities': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshed': self.refreshed,
+            'errors': self.errors
+        }
+
+class TrafficRecorder:
+    def __init__(self, path=TRAFFIC_CAPTURE_PATH):
+        self.enabled = bool(path)
+        self.path = path
+        self.recorded = 0
+        # Sin sal fija los ids anónimos solo son estables dentro del mismo proceso
+        self.salt = (TRAFFIC_CAPTURE_SALT or os.urandom(16).hex()).encode()
+        self.capture_logger = logging.getLogger('FusionBot.capture')
+        if self.enabled:
+            handler = RotatingFileHandler(path, maxBytes=TRAFFIC_CAPTURE_MAX_BYTES,
+                                          backupCount=TRAFFIC_CAPTURE_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.capture_logger.addHandler(handler)
+            self.capture_logger.setLevel(logging.INFO)
+            self.capture_logger.propagate = False
+
+    def anonymize_id(self, value):
+        digest = hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+        anon = int.from_bytes(digest[:6], 'big')
+        return -anon if int(value) < 0 else anon
+
+    @staticmethod
+    def mask(text):
+        return re.sub(r'\S', 'x', text)
+
+    def anonymize_text(self, text):
+        if not text.startswith('/'):
+            return self.mask(text)
+        parts = text.split(' ', 1)
+        if len(parts) < 2:
+            return text
+        comando, args = parts
+        if comando.split('@')[0] in CAPTURE_KEEP_ARGS:
+            return text
+        if comando.split('@')[0] == '/programar':
+            parsed = TimeParser.split(args)
+            if parsed:
+                return f"{comando} {parsed[1]} {self.mask(parsed[2])}"
+        return f"{comando} {self.mask(args)}"
+
+    def record(self, update):
+        if not self.enabled or 'message' not in update:
+            return
+        try:
+            message = update['message']
+            user_id = self.anonymize_id(message['from']['id'])
+            self.capture_logger.info(json.dumps({
+                't': round(time.time(), 3),
+                'tenant': active_tenant().name,
+                'update_id': update['update_id'],
+                'message': {
+                    'message_id': message.get('message_id'),
+                    'date': message.get('date'),
+                    'chat': {'id': self.anonymize_id(message['chat']['id']), 'type': message['chat'].get('type')},
+                    'from': {'id': user_id, 'username': f"u{user_id}"},
+                    'text': self.anonymize_text(message.get('text', ''))
+                }
+            }, ensure_ascii=False))
+            self.recorded += 1
+        except Exception as e:
+            logger.error(f"Error capturando tráfico: {e}")
+
+    def report(self):
+        return {'enabled': self.enabled, 'path': self.path, 'recorded': self.recorded}
+
+class SectionStore(dict):
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader
+
+    def __missing__(self, name):
+        section = self.loader(name)
+        self[name] = section
+        return section
+
+class DataManager:
+    def __init__(self, data_file=DATA_FILE):
+        self.data_file = data_file
+        self.snapshot = None
+        self.created_at = datetime.now().isoformat()
+        self.data = SectionStore(self.load_section)
+        if not self.uses_snapshot():
+            self.data.update(self.default_sections())
+        self.load_data()
+    
+    def uses_snapshot(self):
+        return self.data_file.endswith(SNAPSHOT_SUFFIX)
+    
+    def default_sections(self):
+        return {
             'messenger': {'scheduled_messages': []},
             'loto': {'prediction_history': [], 'charada_cubana': self.load_charada()},
             'weather': {'user_locations': {}},
             'users': {'profiles': {}},
             'analytics': {'command_usage': {}},
-            'keepalive': {'pings': [], 'uptime_start': datetime.now().isoformat()}
+            'keepalive': {'pings': [], 'uptime_start': self.created_at},
+            'telegram': {'offset': 0}
         }
-        self.load_data()
     
     def load_charada(self):
         return {
@@ -66,10 +431,25 @@ class DataManager:
             100: {"nombre": "Excremento", "significados": ["suerte", "dinero", "fortuna", "premio"]}
         }
     
+    def load_section(self, name):
+        defaults = self.default_sections()
+        if name not in defaults:
+            raise KeyError(name)
+        section = defaults[name]
+        if self.snapshot and name in self.snapshot.entries:
+            try:
+                section.update(self.snapshot.load_section(name))
+            except Exception as e:
+                logger.error(f"Error cargando sección {name}: {e}")
+        return section
+    
     def load_data(self):
         try:
-            if os.path.exists('fusion_bot_data.json'):
-                with open('fusion_bot_data.json', 'r', encoding='utf-8') as f:
+            if os.path.exists(self.data_file):
+                if self.uses_snapshot():
+                    self.snapshot = Snapshot(self.data_file)
+                    return
+                with open(self.data_file, 'r', encoding='utf-8') as f:
                     loaded = json.load(f)
                     for section in self.data:
                         if section in loaded:
@@ -79,7 +459,10 @@ class DataManager:
     
     def save_data(self):
         try:
-            with open('fusion_bot_data.json', 'w', encoding='utf-8') as f:
+            if self.uses_snapshot():
+                write_snapshot(self.data_file, self.data, self.snapshot)
+                return
+            with open(self.data_file, 'w', encoding='utf-8') as f:
                 json.dump(self.data, f, indent=2, ensure_ascii=False)
         except Exception as e:
             logger.error(f"Error guardando datos: {e}")
@@ -109,35 +492,295 @@ class DataManager:
         
         self.save_data()
 
-data_manager = DataManager()
+class Tenant:
+    def __init__(self, name, token, data_file):
+        self.name = name
+        self.token = token
+        self.api_url = f"{TELEGRAM_API_BASE}{token}"
+        self.data_manager = DataManager(data_file)
+        self.flood_control = FloodControl()
+        self.backlog_stats = {}
+        self.lock = RLock()
+        self.updates = 0
+        self.throttled = 0
+        self.dropped = 0
+        self.replies = 0
+        self.handling_seconds = 0.0
+
+    def report(self):
+        data = self.data_manager.data
+        return {
+            'updates': self.updates,
+            'throttled': self.throttled,
+            'dropped': self.dropped,
+            'replies': self.replies,
+            'avg_handling_ms': round(self.handling_seconds / self.updates * 1000, 3) if self.updates else None,
+            # Solo secciones ya cargadas: /metrics no debe forzar la lectura del snapshot
+            'users': len(data['users']['profiles']) if 'users' in data else None,
+            'scheduled_messages': len(data['messenger']['scheduled_messages']) if 'messenger' in data else None,
+            'data_file': self.data_manager.data_file,
+            'data_bytes': os.path.getsize(self.data_manager.data_file) if os.path.exists(self.data_manager.data_file) else 0,
+            'backlog': self.backlog_stats,
+            'flood_control': self.flood_control.report()
+        }
+
+class TenantProxy:
+    def __init__(self, attribute):
+        object.__setattr__(self, 'attribute', attribute)
+
+    def __getattr__(self, name):
+        return getattr(getattr(active_tenant(), self.attribute), name)
+
+    def __setattr__(self, name, value):
+        setattr(getattr(active_tenant(), self.attribute), name, value)
+
+def tenant_specs():
+    specs = []
+    if TELEGRAM_BOT_TOKEN:
+        specs.append(('default', TELEGRAM_BOT_TOKEN))
+    for item in TELEGRAM_BOT_TOKENS.split(','):
+        if item.strip():
+            name, _, token = item.strip().partition('=')
+            if not re.fullmatch(r'[A-Za-z0-9_-]+', name) or not token:
+                raise ValueError(f"Tenant inválido en TELEGRAM_BOT_TOKENS: {name}")
+            if name == 'default':
+                raise ValueError("El nombre 'default' está reservado para TELEGRAM_BOT_TOKEN")
+            if name in (spec[0] for spec in specs):
+                raise ValueError(f"Tenant duplicado en TELEGRAM_BOT_TOKENS: {name}")
+            specs.append((name, token))
+    return specs or [('default', None)]
+
+def tenant_data_file(name):
+    if name == 'default':
+        return DATA_FILE
+    root, ext = os.path.splitext(DATA_FILE)
+    return f"{root}.{name}{ext}"
+
+def load_tenants():
+    return {name: Tenant(name, token, tenant_data_file(name)) for name, token in tenant_specs()}
+
+current_tenant = ContextVar('current_tenant', default=None)
+
+def active_tenant():
+    return current_tenant.get() or default_tenant
+
+@contextmanager
+def tenant_context(tenant):
+    token = current_tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        current_tenant.reset(token)
+
+warmup_manager = WarmupManager()
+_load_started = time.time()
+tenants = load_tenants()
+default_tenant = next(iter(tenants.values()))
+warmup_manager.record_phase('load_data', _load_started)
+data_manager = TenantProxy('data_manager')
+flood_control = TenantProxy('flood_control')
 keepalive_manager = KeepAliveManager()
+weather_service = WeatherService()
+traffic_recorder = TrafficRecorder()
 
 class TelegramAPI:
     @staticmethod
     def send_message(chat_id, text, reply_markup=None):
         try:
-            url = f"{TELEGRAM_API}/sendMessage"
+            tenant = active_tenant()
+            url = f"{tenant.api_url}/sendMessage"
             payload = {'chat_id': chat_id, 'text': text, 'parse_mode': 'Markdown'}
             if reply_markup:
                 payload['reply_markup'] = json.dumps(reply_markup)
             
-            response = requests.post(url, json=payload, timeout=30)
-            return response.json().get('ok', False)
+            response = http_session.post(url, json=payload, timeout=30)
+            ok = response.json().get('ok', False)
+            if ok:
+                tenant.replies += 1
+                warmup_manager.mark_reply()
+            return ok
         except Exception as e:
             logger.error(f"Error enviando mensaje: {e}")
             return False
     
     @staticmethod
-    def get_updates(offset=0):
+    def get_updates(offset=0, timeout=30, limit=TELEGRAM_BATCH_LIMIT):
         try:
-            url = f"{TELEGRAM_API}/getUpdates"
-            params = {'offset': offset, 'timeout': 30}
-            response = requests.get(url, params=params, timeout=35)
+            url = f"{active_tenant().api_url}/getUpdates"
+            params = {'offset': offset, 'timeout': timeout, 'limit': limit}
+            response = http_session.get(url, params=params, timeout=timeout + 5)
             return response.json()
         except Exception as e:
             logger.error(f"Error obteniendo updates: {e}")
             return {'ok': False, 'result': []}
 
+WEEKDAYS = {
+    'lunes': 0, 'martes': 1, 'miercoles': 2, 'jueves': 3, 'viernes': 4, 'sabado': 5, 'domingo': 6,
+    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3, 'friday': 4, 'saturday': 5, 'sunday': 6
+}
+DAILY_WORDS = {'cada dia', 'todos los dias', 'diario', 'diariamente', 'every day', 'daily'}
+WORKDAY_WORDS = {'entre semana', 'laborables', 'cada dia laborable', 'weekdays', 'every weekday'}
+RELATIVE_UNITS = {'m': 'minutes', 'min': 'minutes', 'h': 'hours', 'd': 'days'}
+
+class TimeParser:
+    MAX_TOKENS = 6
+
+    @staticmethod
+    def normalize(text):
+        text = unicodedata.normalize('NFKD', text.lower())
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+        text = re.sub(r'\b(a las|a la|at)\b', ' ', text)
+        return ' '.join(text.split())
+
+    @staticmethod
+    def resolve_tz(spec):
+        if not spec:
+            return None
+        m = re.fullmatch(r'(?:utc|gmt)(?:([+-])(\d{1,2})(?::?(\d{2}))?)?', spec.lower())
+        if m:
+            if not m.group(1):
+                return timezone.utc
+            offset = timedelta(hours=int(m.group(2)), minutes=int(m.group(3) or 0))
+            return timezone(offset if m.group(1) == '+' else -offset)
+        if '/' in spec:
+            try:
+                return ZoneInfo(spec)
+            except (ZoneInfoNotFoundError, ValueError):
+                return None
+        return None
+
+    @staticmethod
+    def parse_clock(text):
+        m = re.fullmatch(r'(\d{1,2})(?::(\d{2}))?(am|pm)?', text)
+        if not m or (m.group(2) is None and m.group(3) is None):
+            return None
+        hour, minute = int(m.group(1)), int(m.group(2) or 0)
+        if m.group(3):
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if m.group(3) == 'pm' else 0)
+        if hour > 23 or minute > 59:
+            return None
+        return hour, minute
+
+    @staticmethod
+    def parse_days(text):
+        days = []
+        for word in re.split(r'\s*,\s*|\s+y\s+|\s+and\s+|\s+', text):
+            if not word:
+                continue
+            day = WEEKDAYS.get(word, WEEKDAYS.get(word[:-1]) if word.endswith('s') else None)
+            if day is None:
+                return None
+            days.append(day)
+        return sorted(set(days)) or None
+
+    @staticmethod
+    def to_local(day, clock, tz):
+        moment = datetime(day.year, day.month, day.day, *clock)
+        if tz:
+            return moment.replace(tzinfo=tz).astimezone().replace(tzinfo=None)
+        return moment
+
+    @staticmethod
+    def parse(expr, now=None):
+        now = now or datetime.now()
+        tokens = expr.split()
+        tz_spec = None
+        if len(tokens) > 1 and TimeParser.resolve_tz(tokens[-1]):
+            tz_spec = tokens.pop()
+        tz = TimeParser.resolve_tz(tz_spec)
+        text = TimeParser.normalize(' '.join(tokens))
+
+        m = re.fullmatch(r'(\d+)\s*(m|min|h|d)', text)
+        if m and not tz_spec:
+            return {'freq': 'unico', 'fecha': now + timedelta(**{RELATIVE_UNITS[m.group(2)]: int(m.group(1))})}
+
+        m = re.fullmatch(r'(?:cada|every)\s+(\d+)\s*(m|min|h|d)', text)
+        if m and not tz_spec:
+            minutos = int(timedelta(**{RELATIVE_UNITS[m.group(2)]: int(m.group(1))}).total_seconds() // 60)
+            if minutos < 1:
+                return None
+            return {'freq': 'intervalo', 'minutos': minutos, 'inicio': now.isoformat()}
+
+        head, _, clock_text = text.rpartition(' ')
+        clock = TimeParser.parse_clock(clock_text)
+        if not clock:
+            return None
+        hora = f"{clock[0]:02d}:{clock[1]:02d}"
+
+        if head in DAILY_WORDS:
+            return {'freq': 'diario', 'hora': hora, 'tz': tz_spec}
+        if head in WORKDAY_WORDS:
+            return {'freq': 'semanal', 'dias': [0, 1, 2, 3, 4], 'hora': hora, 'tz': tz_spec}
+        m = re.fullmatch(r'(?:cada|todos los|todas las|every)\s+(.+)', head)
+        if m:
+            dias = TimeParser.parse_days(m.group(1))
+            if dias:
+                return {'freq': 'semanal', 'dias': dias, 'hora': hora, 'tz': tz_spec}
+            return None
+
+        today = now.astimezone(tz).date() if tz else now.date()
+        if head in ('', 'hoy', 'today'):
+            fecha = TimeParser.to_local(today, clock, tz)
+            if not head and fecha <= now:
+                fecha = TimeParser.to_local(today + timedelta(days=1), clock, tz)
+        elif head in ('manana', 'tomorrow'):
+            fecha = TimeParser.to_local(today + timedelta(days=1), clock, tz)
+        elif head in WEEKDAYS:
+            day = today + timedelta(days=(WEEKDAYS[head] - today.weekday()) % 7)
+            fecha = TimeParser.to_local(day, clock, tz)
+            if fecha <= now:
+                fecha = TimeParser.to_local(day + timedelta(days=7), clock, tz)
+        else:
+            m = re.fullmatch(r'(\d{4})-(\d{1,2})-(\d{1,2})', head)
+            n = re.fullmatch(r'(\d{1,2})/(\d{1,2})(?:/(\d{2}|\d{4}))?', head)
+            try:
+                if m:
+                    day = date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+                elif n:
+                    year = int(n.group(3)) if n.group(3) else today.year
+                    day = date(year + 2000 if year < 100 else year, int(n.group(2)), int(n.group(1)))
+                    if not n.group(3) and TimeParser.to_local(day, clock, tz) <= now:
+                        day = day.replace(year=day.year + 1)
+                else:
+                    return None
+            except ValueError:
+                return None
+            fecha = TimeParser.to_local(day, clock, tz)
+        return {'freq': 'unico', 'fecha': fecha}
+
+    @staticmethod
+    def split(text, now=None):
+        spans = [m.span() for m in re.finditer(r'\S+', text)]
+        for n in range(min(len(spans) - 1, TimeParser.MAX_TOKENS), 0, -1):
+            expr = text[:spans[n - 1][1]]
+            regla = TimeParser.parse(expr, now)
+            if regla:
+                return regla, expr.strip(), text[spans[n][0]:]
+        return None
+
+    @staticmethod
+    def next_occurrence(regla, after):
+        if regla['freq'] == 'intervalo':
+            inicio = datetime.fromisoformat(regla['inicio'])
+            paso = timedelta(minutes=regla['minutos'])
+            if after < inicio:
+                return inicio + paso
+            return inicio + paso * ((after - inicio) // paso + 1)
+
+        tz = TimeParser.resolve_tz(regla.get('tz'))
+        clock = tuple(int(x) for x in regla['hora'].split(':'))
+        today = after.astimezone(tz).date() if tz else after.date()
+        for offset in range(8):
+            day = today + timedelta(days=offset)
+            if regla['freq'] == 'semanal' and day.weekday() not in regla['dias']:
+                continue
+            fecha = TimeParser.to_local(day, clock, tz)
+            if fecha > after:
+                return fecha
+        return None
+
 class MessageHandler:
     @staticmethod
     def handle_message(message):
@@ -146,6 +789,12 @@ class MessageHandler:
         user_id = message['from']['id']
         username = message['from'].get('username', 'Usuario')
         
+        decision = flood_control.check(user_id, chat_id, text)
+        if decision != 'ok':
+            if decision == 'throttle':
+                TelegramAPI.send_message(chat_id, THROTTLE_REPLY)
+            return decision
+        
         data_manager.update_user_stats(user_id, text.split()[0])
         
         if text == '/start':
@@ -189,6 +838,9 @@ class MessageHandler:
         elif text == '/ver_programados':
             MessageHandler.handle_ver_programados(chat_id, user_id)
         
+        elif text.startswith('/cancelar'):
+            MessageHandler.handle_cancelar(chat_id, user_id, text)
+        
         elif text == '/loto':
             MessageHandler.handle_loto_predict(chat_id, user_id)
         
@@ -199,9 +851,12 @@ class MessageHandler:
             except:
                 TelegramAPI.send_message(chat_id, "❌ Formato: ")
         
+        elif text.startswith('/clima_diario'):
+            MessageHandler.handle_clima_diario(chat_id, user_id, text)
+        
         elif text.startswith('/clima'):
             try:
-                ciudad = ' '.join(text.split()[1:])
+                ciudad = ' '.join(text.split()[1:]) or data_manager.data['weather']['user_locations'].get(str(user_id))
                 if ciudad:
                     MessageHandler.handle_clima(chat_id, user_id, ciudad)
                 else:
@@ -279,7 +934,10 @@ class MessageHandler:
 •  - Programar mensaje en 30 minutos
 •  - Programar en 2 horas  
 •  - Programar en 1 día
+•  - Programar a una hora o fecha exacta
+•  - Recordatorio diario o semanal
 •  - Ver todos los mensajes pendientes
+•  - Cancelar un mensaje programado
 
 *🎯 LOTO PREDICTOR:*
 •  - Predicción IA con 4 números recomendados
@@ -289,6 +947,8 @@ class MessageHandler:
 *🌤️ CLIMA:*
 •  - Clima actual en Madrid
 •  - Clima en cualquier ciudad del mundo
+•  - Clima de tu última ciudad consultada
+•  - Resumen diario del clima a la hora indicada
 
 *📊 ANALYTICS:*
 •  - Tus estadísticas personales y nivel
@@ -308,12 +968,14 @@ class MessageHandler:
                 f"Comando no reconocido: \n\n"
                 f"Usa  para ver todos los comandos disponibles.\n"
                 f"Usa  para ver el menú principal.")
+        
+        return decision
     
     @staticmethod
     def handle_programar(chat_id, user_id, text):
         try:
-            parts = text.split(' ', 2)
-            if len(parts) < 3:
+            parts = text.split(' ', 1)
+            if len(parts) < 2 or not parts[1].strip():
                 TelegramAPI.send_message(chat_id, 
                     "❌ Formato: \n\n"
                     "Ejemplos:\n"
@@ -322,34 +984,50 @@ class MessageHandler:
                     "• ")
                 return
             
-            tiempo_str = parts[1]
-            mensaje = parts[2]
+            now = datetime.now()
+            parsed = TimeParser.split(parts[1], now)
+            if not parsed:
+                TelegramAPI.send_message(chat_id,
+                    "❌ Formato de tiempo inválido. Usa: 30m, 2h, 1d, 18:30, mañana 9:00, "
+                    "viernes 20:00, 25/12 10:00, cada día 8:00, cada lunes 9:00, cada 2h "
+                    "(opcional: zona horaria como UTC-5 o America/Havana)")
+                return
+            
+            regla, tiempo_str, mensaje = parsed
             
-            if tiempo_str.endswith('m'):
-                minutos = int(tiempo_str[:-1])
-                fecha_envio = datetime.now() + timedelta(minutes=minutos)
-            elif tiempo_str.endswith('h'):
-                horas = int(tiempo_str[:-1])
-                fecha_envio = datetime.now() + timedelta(hours=horas)
-            elif tiempo_str.endswith('d'):
-                dias = int(tiempo_str[:-1])
-                fecha_envio = datetime.now() + timedelta(days=dias)
+            if regla['freq'] == 'unico':
+                fecha_envio = regla['fecha']
+                if fecha_envio <= now:
+                    TelegramAPI.send_message(chat_id, "❌ Esa fecha ya pasó. Indica un momento futuro.")
+                    return
             else:
-                TelegramAPI.send_message(chat_id, "❌ Formato de tiempo inválido. Usa: 30m, 2h, 1d")
-                return
+                fecha_envio = TimeParser.next_occurrence(regla, now)
             
             mensaje_programado = {
                 'chat_id': chat_id,
                 'user_id': str(user_id),
                 'mensaje': mensaje,
                 'fecha_envio': fecha_envio.isoformat(),
-                'programado_en': datetime.now().isoformat(),
+                'programado_en': now.isoformat(),
                 'estado': 'pendiente'
             }
+            if regla['freq'] != 'unico':
+                mensaje_programado['regla'] = regla
+                mensaje_programado['expresion'] = tiempo_str
+                mensaje_programado['envios'] = 0
             
             data_manager.data['messenger']['scheduled_messages'].append(mensaje_programado)
             data_manager.save_data()
             
+            if 'regla' in mensaje_programado:
+                TelegramAPI.send_message(chat_id,
+                    f"🔁 *Mensaje Recurrente Programado* ✅\n\n"
+                    f"📝 *Mensaje:* {mensaje}\n"
+                    f"🔄 *Repetición:* {tiempo_str}\n"
+                    f"🕐 *Próximo envío:* {fecha_envio.strftime('%d/%m/%Y %H:%M')}\n\n"
+                    f"Usa  para ver todos tus mensajes.")
+                return
+            
             TelegramAPI.send_message(chat_id,
                 f"⏰ *Mensaje Programado* ✅\n\n"
                 f"📝 *Mensaje:* {mensaje}\n"
@@ -373,10 +1051,33 @@ class MessageHandler:
         for i, msg in enumerate(mensajes[:10], 1):
             fecha = datetime.fromisoformat(msg['fecha_envio'])
             texto += f"{i}. 📝 {msg['mensaje'][:30]}...\n"
-            texto += f"   🕐 {fecha.strftime('%d/%m %H:%M')}\n\n"
+            texto += f"   🕐 {fecha.strftime('%d/%m %H:%M')}\n"
+            if 'regla' in msg:
+                texto += f"   🔁 {msg['expresion']}\n"
+            texto += "\n"
         
         TelegramAPI.send_message(chat_id, texto)
     
+    @staticmethod
+    def handle_cancelar(chat_id, user_id, text):
+        mensajes = [m for m in data_manager.data['messenger']['scheduled_messages'] 
+                   if m['user_id'] == str(user_id) and m['estado'] == 'pendiente']
+        
+        try:
+            indice = int(text.split()[1])
+            if indice < 1:
+                raise IndexError
+            mensaje = mensajes[indice - 1]
+        except (IndexError, ValueError):
+            TelegramAPI.send_message(chat_id, "❌ Indica el número del mensaje a cancelar según tu lista de programados.")
+            return
+        
+        mensaje['estado'] = 'cancelado'
+        mensaje['cancelado_en'] = datetime.now().isoformat()
+        data_manager.save_data()
+        
+        TelegramAPI.send_message(chat_id, f"🗑️ Mensaje cancelado: {mensaje['mensaje'][:30]}")
+    
     @staticmethod
     def handle_loto_predict(chat_id, user_id):
         try:
@@ -440,6 +1141,17 @@ class MessageHandler:
         except Exception as e:
             TelegramAPI.send_message(chat_id, f"❌ Error consultando charada: {str(e)}")
     
+    @staticmethod
+    def format_clima(ciudad, entry):
+        actualizado, datos = entry
+        texto = f"🌤️ *Clima en {ciudad.title()}*\n\n"
+        texto += f"🌡️ *Temperatura:* {datos['temp']}°C\n"
+        texto += f"☁️ *Condición:* {datos['descripcion'].title()}\n"
+        texto += f"💧 *Humedad:* {datos['humedad']}%\n"
+        texto += f"💨 *Viento:* {datos['viento']} m/s\n"
+        texto += f"\n📅 *Actualizado:* {datetime.fromtimestamp(actualizado).strftime('%H:%M')}"
+        return texto
+    
     @staticmethod
     def handle_clima(chat_id, user_id, ciudad):
         if not OPENWEATHER_API_KEY:
@@ -449,35 +1161,15 @@ class MessageHandler:
             return
         
         try:
-            url = f"http://api.openweathermap.org/data/2.5/weather"
-            params = {
-                'q': ciudad,
-                'appid': OPENWEATHER_API_KEY,
-                'units': 'metric',
-                'lang': 'es'
-            }
+            entry = weather_service.get(ciudad)
             
-            response = requests.get(url, params=params, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
+            if entry:
+                TelegramAPI.send_message(chat_id, MessageHandler.format_clima(ciudad, entry))
                 
-                temp = data['main']['temp']
-                descripcion = data['weather'][0]['description']
-                humedad = data['main']['humidity']
-                viento = data['wind']['speed']
-                
-                texto = f"🌤️ *Clima en {ciudad.title()}*\n\n"
-                texto += f"🌡️ *Temperatura:* {temp}°C\n"
-                texto += f"☁️ *Condición:* {descripcion.title()}\n"
-                texto += f"💧 *Humedad:* {humedad}%\n"
-                texto += f"💨 *Viento:* {viento} m/s\n"
-                texto += f"\n📅 *Actualizado:* {datetime.now().strftime('%H:%M')}"
-                
-                TelegramAPI.send_message(chat_id, texto)
-                
-                data_manager.data['weather']['user_locations'][str(user_id)] = ciudad
-                data_manager.save_data()
+                user_locations = data_manager.data['weather']['user_locations']
+                if user_locations.get(str(user_id)) != ciudad:
+                    user_locations[str(user_id)] = ciudad
+                    data_manager.save_data()
                 
             else:
                 TelegramAPI.send_message(chat_id, f"❌ Ciudad '{ciudad}' no encontrada.")
@@ -485,6 +1177,51 @@ class MessageHandler:
         except Exception as e:
             TelegramAPI.send_message(chat_id, f"❌ Error consultando clima: {str(e)}")
     
+    @staticmethod
+    def handle_clima_diario(chat_id, user_id, text):
+        mensajes = data_manager.data['messenger']['scheduled_messages']
+        args = ' '.join(text.split()[1:])
+        
+        if args.lower() == 'off':
+            cancelados = 0
+            for m in mensajes:
+                if m.get('clima') and m['user_id'] == str(user_id) and m['estado'] == 'pendiente':
+                    m['estado'] = 'cancelado'
+                    cancelados += 1
+            if cancelados:
+                data_manager.save_data()
+            TelegramAPI.send_message(chat_id, f"🗑️ Resumen diario del clima desactivado ({cancelados}).")
+            return
+        
+        ciudad = data_manager.data['weather']['user_locations'].get(str(user_id))
+        regla = TimeParser.parse(f"cada dia {args}") if args else None
+        if not ciudad or not regla:
+            TelegramAPI.send_message(chat_id,
+                "❌ Consulta primero el clima de tu ciudad e indica la hora del resumen. "
+                "Ejemplo: 7:30 (opcional: zona horaria como America/Havana)")
+            return
+        
+        now = datetime.now()
+        fecha_envio = TimeParser.next_occurrence(regla, now)
+        mensajes.append({
+            'chat_id': chat_id,
+            'user_id': str(user_id),
+            'mensaje': '🌤️ Resumen diario del clima',
+            'fecha_envio': fecha_envio.isoformat(),
+            'programado_en': now.isoformat(),
+            'estado': 'pendiente',
+            'regla': regla,
+            'expresion': f"cada día {args}",
+            'envios': 0,
+            'clima': True
+        })
+        data_manager.save_data()
+        
+        TelegramAPI.send_message(chat_id,
+            f"🌤️ *Resumen Diario del Clima* ✅\n\n"
+            f"📍 *Ciudad:* {ciudad.title()}\n"
+            f"🕐 *Próximo envío:* {fecha_envio.strftime('%d/%m/%Y %H:%M')}")
+    
     @staticmethod
     def handle_stats(chat_id, user_id):
         profile = data_manager.get_user_profile(user_id)
@@ -512,55 +1249,230 @@ class MessageHandler:
         
         TelegramAPI.send_message(chat_id, texto)
 
+def send_clima_digest(mensaje):
+    ciudad = data_manager.data['weather']['user_locations'].get(mensaje['user_id'])
+    try:
+        entry = weather_service.get(ciudad) if ciudad and OPENWEATHER_API_KEY else None
+    except Exception as e:
+        logger.error(f"Error en resumen de clima: {e}")
+        entry = None
+    
+    if entry:
+        TelegramAPI.send_message(mensaje['chat_id'], MessageHandler.format_clima(ciudad, entry))
+    else:
+        TelegramAPI.send_message(mensaje['chat_id'], "❌ No se pudo obtener el clima para tu resumen diario.")
+
 def process_scheduled_messages():
     try:
         now = datetime.now()
         mensajes_pendientes = [m for m in data_manager.data['messenger']['scheduled_messages'] 
                              if m['estado'] == 'pendiente']
+        enviados = 0
         
         for mensaje in mensajes_pendientes:
             fecha_envio = datetime.fromisoformat(mensaje['fecha_envio'])
             if now >= fecha_envio:
-                TelegramAPI.send_message(
-                    mensaje['chat_id'], 
-                    f"⏰ *Recordatorio Programado:*\n\n{mensaje['mensaje']}"
-                )
+                if mensaje.get('clima'):
+                    send_clima_digest(mensaje)
+                else:
+                    TelegramAPI.send_message(
+                        mensaje['chat_id'], 
+                        f"⏰ *Recordatorio Programado:*\n\n{mensaje['mensaje']}"
+                    )
+                enviados += 1
                 
-                mensaje['estado'] = 'enviado'
-                mensaje['enviado_en'] = now.isoformat()
+                if 'regla' in mensaje:
+                    mensaje['envios'] += 1
+                    mensaje['ultimo_envio'] = now.isoformat()
+                    mensaje['fecha_envio'] = TimeParser.next_occurrence(mensaje['regla'], now).isoformat()
+                else:
+                    mensaje['estado'] = 'enviado'
+                    mensaje['enviado_en'] = now.isoformat()
         
-        data_manager.save_data()
+        if enviados:
+            data_manager.save_data()
         
     except Exception as e:
         logger.error(f"Error procesando mensajes programados: {e}")
 
-def run_bot():
-    offset = 0
+def dispatch_update(update):
+    if 'message' not in update:
+        return
+    tenant = active_tenant()
+    traffic_recorder.record(update)
+    started = time.time()
+    decision = 'ok'
+    with tenant.lock:
+        try:
+            decision = MessageHandler.handle_message(update['message'])
+        except Exception as e:
+            logger.error(f"[{tenant.name}] Error procesando update {update.get('update_id')}: {e}")
+        
+        if decision == 'ok':
+            data_manager.data['keepalive']['pings'].append({
+                'timestamp': datetime.now().isoformat(),
+                'type': 'user_message'
+            })
+    
+    if decision == 'ok':
+        tenant.updates += 1
+        tenant.handling_seconds += time.time() - started
+    elif decision == 'throttle':
+        tenant.throttled += 1
+    else:
+        tenant.dropped += 1
+
+def commit_offset(offset):
+    with active_tenant().lock:
+        if data_manager.data['telegram']['offset'] != offset:
+            data_manager.data['telegram']['offset'] = offset
+            data_manager.data['telegram']['saved_at'] = time.time()
+            data_manager.save_data()
+
+def saved_offset():
+    telegram = data_manager.data['telegram']
+    edad = time.time() - telegram.get('saved_at', 0)
+    if telegram['offset'] and edad > TELEGRAM_OFFSET_MAX_AGE:
+        logger.warning(f"[{active_tenant().name}] Offset guardado con {int(edad // 86400)} días, se ignora")
+        return 0
+    return telegram['offset']
+
+def process_batch(tenant, batch, commit=True):
+    with tenant_context(tenant):
+        for update in batch:
+            dispatch_update(update)
+        if commit and batch:
+            commit_offset(batch[-1]['update_id'] + 1)
+
+def drain_backlog(offset):
+    started = time.time()
+    vistos = set()
+    omitidos = Counter()
+    procesados = antiguos = colapsados = reintentos = 0
+    espera = 1
+    sondeado = not offset
+    
+    while True:
+        updates = TelegramAPI.get_updates(offset, timeout=0)
+        if not updates.get('ok'):
+            reintentos += 1
+            logger.error(f"[{active_tenant().name}] Error drenando backlog, reintento en {espera}s")
+            time.sleep(espera)
+            espera = min(espera * 2, 60)
+            continue
+        
+        espera = 1
+        batch = updates.get('result', [])
+        if not batch:
+            if not sondeado:
+                # Sin updates desde el offset guardado: comprobar que Telegram no ha reiniciado los ids
+                sondeado = True
+                pendientes = TelegramAPI.get_updates(0, timeout=0, limit=1).get('result', [])
+                if pendientes and pendientes[0]['update_id'] < offset:
+                    logger.warning(f"[{active_tenant().name}] update_id reiniciado por Telegram "
+                                   f"({pendientes[0]['update_id']} < {offset}), se descarta el offset guardado")
+                    offset = 0
+                    continue
+            break
+        
+        sondeado = True
+        limite = time.time() - BACKLOG_MAX_AGE
+        for update in batch:
+            offset = update['update_id'] + 1
+            message = update.get('message', {})
+            text = message.get('text', '').strip()
+            comando = text.split()[0] if text else '(sin texto)'
+            
+            if message and message.get('date', 0) < limite:
+                antiguos += 1
+                omitidos[comando] += 1
+                continue
+            
+            if text.startswith('/'):
+                clave = (message['chat']['id'], text)
+                if clave in vistos:
+                    colapsados += 1
+                    omitidos[comando] += 1
+                    continue
+                vistos.add(clave)
+            
+            dispatch_update(update)
+            procesados += 1
+        
+        commit_offset(offset)
+    
+    backlog_stats = active_tenant().backlog_stats
+    backlog_stats.update({
+        'processed': procesados,
+        'skipped_stale': antiguos,
+        'collapsed_duplicates': colapsados,
+        'retries': reintentos,
+        'skipped_by_command': dict(omitidos),
+        'seconds': round(time.time() - started, 3),
+        'drained_at': datetime.now().isoformat()
+    })
+    logger.info(f"📥 [{active_tenant().name}] Backlog drenado en {backlog_stats['seconds']}s: {procesados} procesados, "
+                f"{antiguos} antiguos (> {BACKLOG_MAX_AGE}s) y {colapsados} duplicados omitidos")
+    if omitidos:
+        logger.info(f"📥 [{active_tenant().name}] Omitidos por comando: {dict(omitidos)}")
+    return offset
+
+def run_bot(tenant):
+    current_tenant.set(tenant)
+    offset = drain_backlog(saved_offset())
     
     while True:
         try:
             updates = TelegramAPI.get_updates(offset)
             
             if updates.get('ok'):
-                for update in updates.get('result', []):
-                    offset = update['update_id'] + 1
-                    
-                    if 'message' in update:
-                        MessageHandler.handle_message(update['message'])
-                        
-                        data_manager.data['keepalive']['pings'].append({
-                            'timestamp': datetime.now().isoformat(),
-                            'type': 'user_message'
-                        })
+                batch = updates.get('result', [])
+                if batch:
+                    offset = batch[-1]['update_id'] + 1
+                    worker_pool.submit(process_batch, tenant, batch).result()
             else:
-                logger.error("Error obteniendo updates de Telegram")
+                logger.error(f"[{tenant.name}] Error obteniendo updates de Telegram")
                 time.sleep(10)
                 
         except Exception as e:
-            logger.error(f"Error en bot principal: {e}")
+            logger.error(f"[{tenant.name}] Error en bot principal: {e}")
             time.sleep(10)
 
-schedule.every(1).minutes.do(process_scheduled_messages)
+def for_each_tenant(func):
+    def run():
+        for tenant in tenants.values():
+            with tenant_context(tenant), tenant.lock:
+                func()
+    return run
+
+def all_user_locations():
+    locations = {}
+    for tenant in tenants.values():
+        for user_id, ciudad in list(tenant.data_manager.data['weather']['user_locations'].items()):
+            locations[f"{tenant.name}:{user_id}"] = ciudad
+    return locations
+
+schedule.every(1).minutes.do(for_each_tenant(process_scheduled_messages))
+schedule.every(5).minutes.do(for_each_tenant(lambda: flood_control.evict()))
+
+def warm_state():
+    for tenant in tenants.values():
+        for section in ('users', 'analytics', 'messenger'):
+            tenant.data_manager.data[section]
+
+def warm_telegram_connection():
+    for tenant in tenants.values():
+        response = http_session.get(f"{tenant.api_url}/getMe", timeout=10)
+        if not response.json().get('ok'):
+            raise RuntimeError(f"getMe falló para el tenant {tenant.name}: {response.json().get('description')}")
+
+def warm_openweather_connection():
+    if OPENWEATHER_API_KEY:
+        http_session.head(OPENWEATHER_API, timeout=10)
+
+warmup_manager.add_step('state', warm_state)
+warmup_manager.add_step('telegram_connection', warm_telegram_connection, required=True)
+warmup_manager.add_step('openweather_connection', warm_openweather_connection)
 
 def run_scheduler():
     while True:
@@ -591,6 +1503,7 @@ def home():
         'total_commands': sum(data_manager.data['analytics']['command_usage'].values()),
         'scheduled_messages': len(data_manager.data['messenger']['scheduled_messages']),
         'keepalive_pings': keepalive_manager.ping_count,
+        'tenants': list(tenants),
         'version': '7.0-completo-keepalive',
         'timestamp': datetime.now().isoformat()
     })
@@ -613,6 +1526,41 @@ def ping():
         'ping_count': keepalive_manager.ping_count
     })
 
+@app.route('/wake')
+def wake():
+    warmed_now = warmup_manager.warm_up()
+    return jsonify({
+        'status': 'awake',
+        'warmed_now': warmed_now,
+        **warmup_manager.report(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/ready')
+def ready():
+    return jsonify(warmup_manager.report()), 200 if warmup_manager.ready else 503
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError):
+        return None
+
+@app.route('/metrics')
+def metrics():
+    return jsonify({
+        'startup': warmup_manager.report(),
+        'tenants': {name: tenant.report() for name, tenant in tenants.items()},
+        'worker_threads': WORKER_THREADS,
+        'weather_threads': WEATHER_THREADS,
+        'rss_mb': current_rss_mb(),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'weather': weather_service.report(),
+        'traffic_capture': traffic_recorder.report(),
+        'timestamp': datetime.now().isoformat()
+    })
+
 @app.route('/status')
 def status():
     return jsonify({
@@ -626,17 +1574,46 @@ def status():
             'keepalive': 'active'
         },
         'uptime': str(datetime.now() - datetime.fromisoformat(data_manager.data['keepalive']['uptime_start'])),
+        'backlog': default_tenant.backlog_stats,
         'health_score': 100
     })
 
+@app.route('/t/<name>/status')
+def tenant_status(name):
+    tenant = tenants.get(name)
+    if not tenant:
+        return jsonify({'error': f"Tenant '{name}' no encontrado"}), 404
+    return jsonify({'tenant': name, **tenant.report(), 'timestamp': datetime.now().isoformat()})
+
+@app.route('/t/<name>/webhook', methods=['POST'])
+def tenant_webhook(name):
+    tenant = tenants.get(name)
+    if TELEGRAM_UPDATE_MODE != 'webhook' or not TELEGRAM_WEBHOOK_SECRET or not tenant:
+        return jsonify({'error': 'not found'}), 404
+    secreto = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(secreto.encode(), TELEGRAM_WEBHOOK_SECRET.encode()):
+        return jsonify({'error': 'forbidden'}), 403
+    
+    update = request.get_json(silent=True) or {}
+    worker_pool.submit(process_batch, tenant, [update], False)
+    return jsonify({'ok': True})
+
 def run_flask():
     port = int(os.environ.get('PORT', 10000))
     logger.info(f"🌐 Flask iniciando en puerto {port}")
     app.run(host='0.0.0.0', port=port, debug=False)
 
 def main():
-    if not TELEGRAM_BOT_TOKEN:
-        logger.error("❌ TELEGRAM_BOT_TOKEN requerido")
+    if not all(tenant.token for tenant in tenants.values()):
+        logger.error("❌ TELEGRAM_BOT_TOKEN o TELEGRAM_BOT_TOKENS requerido")
+        return
+    
+    if TELEGRAM_UPDATE_MODE not in ('polling', 'webhook'):
+        logger.error(f"❌ TELEGRAM_UPDATE_MODE inválido: {TELEGRAM_UPDATE_MODE}")
+        return
+    
+    if TELEGRAM_UPDATE_MODE == 'webhook' and not TELEGRAM_WEBHOOK_SECRET:
+        logger.error("❌ TELEGRAM_WEBHOOK_SECRET requerido en modo webhook")
         return
     
     logger.info("🚀 INICIANDO FUSION BOT v7.0 - COMPLETO + KEEPALIVE")
@@ -645,17 +1622,22 @@ def main():
     logger.info("🌤️ Clima inteligente con API real")
     logger.info("📊 Analytics y estadísticas personales")
     logger.info("🔄 Sistema keepalive 24/7 activado")
+    logger.info(f"🤖 {len(tenants)} bots en este proceso: {', '.join(tenants)} (modo {TELEGRAM_UPDATE_MODE})")
     
     threads = []
     
-    bot_thread = Thread(target=run_bot, daemon=True, name="BotPrincipal")
-    bot_thread.start()
-    threads.append(bot_thread)
-    
     flask_thread = Thread(target=run_flask, daemon=True, name="FlaskKeepAlive")
     flask_thread.start()
     threads.append(flask_thread)
     
+    warmup_manager.warm_up()
+    
+    if TELEGRAM_UPDATE_MODE == 'polling':
+        for tenant in tenants.values():
+            bot_thread = Thread(target=run_bot, args=(tenant,), daemon=True, name=f"Bot-{tenant.name}")
+            bot_thread.start()
+            threads.append(bot_thread)
+    
     keepalive_thread = Thread(target=keepalive_manager.run_keepalive_loop, daemon=True, name="KeepAliveManager")
     keepalive_thread.start()
     threads.append(keepalive_thread)
@@ -664,6 +1646,10 @@ def main():
     scheduler_thread.start()
     threads.append(scheduler_thread)
     
+    weather_thread = Thread(target=weather_service.run_refresh_loop, daemon=True, name="WeatherRefresher")
+    weather_thread.start()
+    threads.append(weather_thread)
+    
     logger.info(f"✅ {len(threads)} servicios iniciados")
     logger.info("🔥 FUSION BOT COMPLETO FUNCIONANDO 24/7")
     
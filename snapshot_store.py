@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+SNAPSHOT BINARIO DE DATOS
+Contenedor por secciones con tabla de offsets. Cada sección se decodifica en
+su primer acceso y las listas grandes se leen vía mmap registro a registro.
+
+Uso:
+    python snapshot_store.py to-snap fusion_bot_data.json fusion_bot_data.snap
+    python snapshot_store.py to-json fusion_bot_data.snap fusion_bot_data.json
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from collections.abc import MutableSequence
+
+SNAPSHOT_SUFFIX = '.snap'
+MAGIC = b'FBSNAP01'
+KIND_JSON = 0
+KIND_RECORDS = 1
+
+# Listas que solo crecen: se guardan como registros independientes y no se materializan
+LIST_FIELDS = {
+    'keepalive': ('pings',),
+    'loto': ('prediction_history',)
+}
+
+HEADER = struct.Struct('<8sI')
+ENTRY = struct.Struct('<HBQQ')
+COUNT = struct.Struct('<I')
+OFFSET = struct.Struct('<Q')
+
+def encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class MappedList(MutableSequence):
+    def __init__(self, buffer, start, end):
+        self._buffer = buffer
+        self._count = COUNT.unpack_from(buffer, start)[0]
+        self._index = start + COUNT.size
+        self._records = self._index + self._count * OFFSET.size
+        self._end = end
+        self._tail = []
+
+    def _bounds(self, index):
+        start = self._records + OFFSET.unpack_from(self._buffer, self._index + index * OFFSET.size)[0]
+        if index + 1 < self._count:
+            end = self._records + OFFSET.unpack_from(self._buffer, self._index + (index + 1) * OFFSET.size)[0]
+        else:
+            end = self._end
+        return start, end
+
+    def _raw(self, index):
+        start, end = self._bounds(index)
+        return self._buffer[start:end]
+
+    def _materialize(self):
+        if self._count:
+            self._tail = [json.loads(self._raw(i)) for i in range(self._count)] + self._tail
+            self._count = 0
+
+    def __len__(self):
+        return self._count + len(self._tail)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('MappedList index out of range')
+        if index < self._count:
+            return json.loads(self._raw(index))
+        return self._tail[index - self._count]
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield json.loads(self._raw(i))
+        yield from self._tail
+
+    def __setitem__(self, index, value):
+        self._materialize()
+        self._tail[index] = value
+
+    def __delitem__(self, index):
+        self._materialize()
+        del self._tail[index]
+
+    def insert(self, index, value):
+        if index >= len(self):
+            self._tail.append(value)
+        else:
+            self._materialize()
+            self._tail.insert(index, value)
+
+    def iter_raw(self):
+        for i in range(self._count):
+            yield self._raw(i)
+        for item in self._tail:
+            yield encode(item)
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} no es un snapshot válido")
+
+        self.entries = {}
+        pos = HEADER.size
+        for _ in range(count):
+            name_len, kind, offset, length = ENTRY.unpack_from(self._map, pos)
+            pos += ENTRY.size
+            name = self._map[pos:pos + name_len].decode('utf-8')
+            pos += name_len
+            self.entries[name] = (kind, offset, length)
+
+    @property
+    def sections(self):
+        return [name for name in self.entries if '.' not in name]
+
+    def raw(self, name):
+        kind, offset, length = self.entries[name]
+        return self._map[offset:offset + length]
+
+    def load_section(self, name):
+        value = json.loads(self.raw(name))
+        prefix = f"{name}."
+        for key, (kind, offset, length) in self.entries.items():
+            if key.startswith(prefix):
+                field = key[len(prefix):]
+                if kind == KIND_RECORDS:
+                    value[field] = MappedList(self._map, offset, offset + length)
+                else:
+                    value[field] = json.loads(self.raw(key))
+        return value
+
+def _records_payload(records):
+    records = list(records)
+    offsets = []
+    position = 0
+    for record in records:
+        offsets.append(OFFSET.pack(position))
+        position += len(record)
+    return COUNT.pack(len(records)) + b''.join(offsets) + b''.join(records)
+
+def _section_entries(name, section):
+    section = dict(section)
+    entries = []
+    for field in LIST_FIELDS.get(name, ()):
+        if field not in section:
+            continue
+        items = section.pop(field)
+        records = items.iter_raw() if isinstance(items, MappedList) else (encode(item) for item in items)
+        entries.append((f"{name}.{field}", KIND_RECORDS, _records_payload(records)))
+    entries.insert(0, (name, KIND_JSON, encode(section)))
+    return entries
+
+def write_snapshot(path, data, source=None):
+    entries = []
+    for name, section in data.items():
+        entries.extend(_section_entries(name, section))
+
+    if source is not None:
+        for name in source.entries:
+            if name.split('.')[0] not in data:
+                kind, offset, length = source.entries[name]
+                entries.append((name, kind, source.raw(name)))
+
+    header_size = HEADER.size + sum(ENTRY.size + len(name.encode('utf-8')) for name, _, _ in entries)
+    table = [HEADER.pack(MAGIC, len(entries))]
+    offset = header_size
+    for name, kind, payload in entries:
+        encoded_name = name.encode('utf-8')
+        table.append(ENTRY.pack(len(encoded_name), kind, offset, len(payload)) + encoded_name)
+        offset += len(payload)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(b''.join(table))
+        for _, _, payload in entries:
+            f.write(payload)
+    os.replace(tmp_path, path)
+
+def to_plain(value):
+    if isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, MappedList)):
+        return [to_plain(item) for item in value]
+    return value
+
+def json_to_snapshot(json_path, snap_path):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    write_snapshot(snap_path, data)
+
+def snapshot_to_json(snap_path, json_path):
+    snapshot = Snapshot(snap_path)
+    data = {name: to_plain(snapshot.load_section(name)) for name in snapshot.sections}
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    commands = {'to-snap': json_to_snapshot, 'to-json': snapshot_to_json}
+    if len(sys.argv) != 4 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+    commands[sys.argv[1]](sys.argv[2], sys.argv[3])
+    print(f"✅ {sys.argv[2]} → {sys.argv[3]}")
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+REPLAY DE TRÁFICO CAPTURADO
+Reproduce capturas JSONL (TRAFFIC_CAPTURE_PATH) a través de MessageHandler
+contra endpoints simulados de Telegram y OpenWeather. Informa de la
+distribución de latencias, el crecimiento del estado y el coste de save_data.
+
+Uso:
+    python traffic_replay.py captura.jsonl captura.jsonl.1 --speed 1
+    python traffic_replay.py captura.jsonl --speed 10 --data-file replay.snap
+    python traffic_replay.py captura.jsonl --speed max --json
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import BaseAdapter
+
+WEATHER_STUB = {
+    'main': {'temp': 24.5, 'humidity': 65},
+    'weather': [{'description': 'cielo claro'}],
+    'wind': {'speed': 3.1}
+}
+
+class StubAdapter(BaseAdapter):
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+
+    def send(self, request, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlparse(request.url)
+        if 'openweathermap' in url.netloc:
+            self.calls['openweather'] += 1
+            body = WEATHER_STUB
+        else:
+            self.calls[f"telegram{url.path[url.path.rfind('/'):]}"] += 1
+            body = {'ok': True, 'result': []}
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(body).encode('utf-8')
+        response.headers['Content-Type'] = 'application/json'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+def load_captures(paths):
+    records = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record['t'])
+    return records
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values), 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50), 3),
+        'p90_ms': round(percentile(values, 90), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(max(values), 3) if values else 0.0
+    }
+
+def state_sample(bot):
+    data = bot.data_manager.data
+    return {
+        'file_bytes': os.path.getsize(bot.data_manager.data_file) if os.path.exists(bot.data_manager.data_file) else 0,
+        'users': len(data['users']['profiles']),
+        'scheduled_messages': len(data['messenger']['scheduled_messages']),
+        'pings': len(data['keepalive']['pings'])
+    }
+
+def replay(args):
+    records = load_captures(args.captures)
+    if not records:
+        print("❌ La captura está vacía")
+        return None
+
+    os.environ['TELEGRAM_BOT_TOKEN'] = 'replay'
+    os.environ.pop('TELEGRAM_BOT_TOKENS', None)
+    os.environ['OPENWEATHER_API_KEY'] = 'replay'
+    temp_dir = None
+    data_file = args.data_file
+    if not data_file:
+        temp_dir = tempfile.mkdtemp(prefix='replay-')
+        data_file = os.path.join(temp_dir, 'fusion_bot_data.json')
+    os.environ['DATA_FILE'] = data_file
+    os.environ.pop('TRAFFIC_CAPTURE_PATH', None)
+    import main as bot
+
+    adapter = StubAdapter(args.upstream_latency / 1000)
+    bot.http_session.mount('https://', adapter)
+    bot.http_session.mount('http://', adapter)
+    if args.disable_flood_control:
+        bot.flood_control.limits = {'user': float('inf'), 'chat': float('inf')}
+
+    save_times = []
+    original_save = bot.data_manager.save_data
+
+    def timed_save():
+        started = time.perf_counter()
+        original_save()
+        save_times.append((time.perf_counter() - started) * 1000)
+
+    bot.data_manager.save_data = timed_save
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    latencies = []
+    by_command = defaultdict(list)
+    samples = [state_sample(bot)]
+    sample_every = max(1, len(records) // 10)
+
+    wall_start = time.perf_counter()
+    first_t = records[0]['t']
+    for i, record in enumerate(records, 1):
+        if speed:
+            delay = (record['t'] - first_t) / speed - (time.perf_counter() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+
+        text = record['message'].get('text', '')
+        comando = text.split()[0].split('@')[0] if text.startswith('/') else '(texto)'
+        started = time.perf_counter()
+        bot.dispatch_update({'update_id': record['update_id'], 'message': record['message']})
+        elapsed = (time.perf_counter() - started) * 1000
+        latencies.append(elapsed)
+        by_command[comando].append(elapsed)
+
+        if i % sample_every == 0:
+            samples.append(state_sample(bot))
+
+    wall = time.perf_counter() - wall_start
+    original_save()
+    samples.append(state_sample(bot))
+    if temp_dir:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {
+        'updates': len(records),
+        'speed': args.speed,
+        'wall_seconds': round(wall, 3),
+        'captured_seconds': round(records[-1]['t'] - first_t, 3),
+        'throughput_per_second': round(len(records) / wall, 1) if wall else None,
+        'latency': summarize(latencies),
+        'latency_by_command': {cmd: summarize(values) for cmd, values in
+                               sorted(by_command.items(), key=lambda item: -len(item[1]))},
+        'save_data': {**summarize(save_times), 'total_seconds': round(sum(save_times) / 1000, 3)},
+        'state': {'start': samples[0], 'end': samples[-1], 'samples': samples},
+        'upstream_calls': dict(adapter.calls),
+        'flood_control': bot.flood_control.report(),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+def print_report(report):
+    latency = report['latency']
+    save = report['save_data']
+    start, end = report['state']['start'], report['state']['end']
+    print(f"🔁 Replay de {report['updates']} updates a velocidad {report['speed']}")
+    print(f"⏱️ {report['wall_seconds']}s reales ({report['captured_seconds']}s capturados), "
+          f"{report['throughput_per_second']} updates/s")
+    print(f"📈 Latencia: p50 {latency['p50_ms']}ms · p90 {latency['p90_ms']}ms · "
+          f"p99 {latency['p99_ms']}ms · max {latency['max_ms']}ms")
+    print("📋 Por comando:")
+    for comando, stats in report['latency_by_command'].items():
+        print(f"   {comando:<16} {stats['count']:>6}  p50 {stats['p50_ms']}ms  p99 {stats['p99_ms']}ms")
+    print(f"💾 save_data: {save['count']} llamadas, {save['total_seconds']}s en total, "
+          f"media {save['mean_ms']}ms, p99 {save['p99_ms']}ms")
+    print(f"🗄️ Estado: {start['file_bytes']} → {end['file_bytes']} bytes, "
+          f"usuarios {start['users']} → {end['users']}, "
+          f"programados {start['scheduled_messages']} → {end['scheduled_messages']}, "
+          f"pings {start['pings']} → {end['pings']}")
+    print(f"🌐 Llamadas simuladas: {report['upstream_calls']}")
+    print(f"🧠 RSS máximo: {report['peak_rss_mb']} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay de tráfico capturado de Fusion Bot")
+    parser.add_argument('captures', nargs='+', help="Ficheros JSONL de captura (incluidos los rotados)")
+    parser.add_argument('--speed', default='1', help="Factor de velocidad (1, 10...) o 'max'")
+    parser.add_argument('--data-file', default=None,
+                        help="Fichero de datos del replay (.json o .snap); por defecto uno temporal")
+    parser.add_argument('--upstream-latency', type=float, default=0.0,
+                        help="Latencia simulada de Telegram/OpenWeather en ms")
+    parser.add_argument('--disable-flood-control', action='store_true')
+    parser.add_argument('--json', action='store_true', help="Imprimir el informe en JSON")
+    args = parser.parse_args()
+
+    report = replay(args)
+    if report is None:
+        sys.exit(1)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)